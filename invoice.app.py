@@ -1,59 +1,294 @@
+import io
+import json
 import os
 import re
 import streamlit as st
 import pandas as pd
-from docx import Document
-from docx.shared import Pt
+import numpy as np
+import queue
 import tempfile
-import shutil
+import time
+import xxhash
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
-import base64
-import zipfile
-import subprocess
-from typing import Optional
-from packing_list_export import export_custom_packing_list
+from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Heavy or rarely needed modules (docx/lxml, openpyxl, zipfile, ...) are
+# imported inside the functions that use them to keep script startup fast
 
 
 # Configuration
 TEMPLATE_PATH = "invoice_template.docx"
 OUTPUT_FOLDER = "generated_invoices"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+# Invoices converted concurrently, one LibreOffice process each
+PDF_WORKERS = os.cpu_count() or 1
+# Renders queued at once in bulk runs; bounds how many finished PDFs wait in memory
+PDF_QUEUE_SIZE = 2 * PDF_WORKERS
+# Buffer size for output files, so each save is a handful of write() calls
+WRITE_BUFFER_SIZE = 1 << 20
+# Bump whenever the rendered invoice changes (filling, formatting), so PDFs
+# persisted by older code are never served
+RENDER_VERSION = 1
+# Rendered invoices kept in the disk cache; entries expire after a day,
+# since the printed date is part of the key
+RENDER_CACHE_TTL = 24 * 60 * 60
+RENDER_CACHE_ENTRIES = 1000
+# Where Streamlit persists disk-cached results
+RENDER_CACHE_DIR = os.path.join(Path.home(), ".streamlit", "cache")
+
+# Fields printed with two decimals on the invoice
+FINANCIAL_FIELDS = frozenset([
+    'PER CHARGES', 'PARKING CHARGES', 'TOTAL CHARGES',
+    'TOTAL CHARGES_SUM', 'RATE', 'CALCULATED_CHARGES'
+])
+NUMERIC_TYPES = (int, float, np.integer, np.floating)
+
+# Template placeholders: {{KEY}} (or {{KEY.}} for KEY)
+PLACEHOLDER_RE = re.compile(r"\{\{([^{}]+?)\}\}")
+
+# Per-customer text columns that repeat on every item row of the upload
+CATEGORY_COLUMNS = [
+    "MARK", "CONTACT NUMBER", "CARGO NUMBER", "TRACKING NUMBER",
+    "TERMS", "业务员/ Supplier"
+]
+
+# Header of the notification log, in notification_entry's key order
+NOTIFICATION_COLUMNS = ["Customer", "Invoice", "Contact", "Amount", "File"]
+
+def content_key(data: dict) -> str:
+    """Compact cache key for a dict, so Streamlit hashes 32 characters instead of the payload"""
+    return xxhash.xxh3_128_hexdigest(json.dumps(data, sort_keys=True, default=str).encode())
+
+def frame_key(df: pd.DataFrame) -> str:
+    """Compact cache key for a DataFrame's columns and values"""
+    h = xxhash.xxh3_128(json.dumps([str(c) for c in df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(df).values)
+    return h.hexdigest()
 
 def sanitize_filename(name: str) -> str:
     """Make strings safe for filenames"""
     return re.sub(r'[\\/:*?"<>|]', '_', name)
 
-def convert_docx_to_pdf(docx_path: str, pdf_path: str) -> bool:
-    """Convert DOCX to PDF using LibreOffice"""
+@st.cache_resource
+def libreoffice_profile_slots() -> "queue.Queue[int]":
+    """Process-wide pool of PDF_WORKERS profile slots (survives script reruns)"""
+    slots = queue.Queue()
+    for slot in range(PDF_WORKERS):
+        slots.put(slot)
+    return slots
+
+@contextmanager
+def libreoffice_profile_uri():
+    """Borrow one of PDF_WORKERS fixed LibreOffice profiles, so concurrent
+    conversions don't fight over one profile lock and the profiles are
+    reused across runs instead of piling up in the temp dir"""
+    slots = libreoffice_profile_slots()
+    slot = slots.get()
     try:
+        yield Path(tempfile.gettempdir(), f"lo_profile_{slot}").as_uri()
+    finally:
+        slots.put(slot)
+
+def convert_docx_to_pdf(docx_path: str) -> bytes:
+    """Convert DOCX to PDF using LibreOffice and return the validated PDF bytes"""
+    import subprocess
+
+    # LibreOffice writes the PDF next to the DOCX (the scratch dir)
+    scratch_dir = os.path.dirname(docx_path)
+    with libreoffice_profile_uri() as profile_uri:
         result = subprocess.run(
-            ["libreoffice", "--headless", "--convert-to", "pdf", "--outdir", 
-             os.path.dirname(pdf_path), docx_path],
+            ["libreoffice", f"-env:UserInstallation={profile_uri}",
+             "--headless", "--convert-to", "pdf", "--outdir", 
+             scratch_dir, docx_path],
             check=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             timeout=30
         )
-        
-        base_name = os.path.splitext(os.path.basename(docx_path))[0]
-        temp_pdf = os.path.join(os.path.dirname(pdf_path), f"{base_name}.pdf")
-        
-        if os.path.exists(temp_pdf):
-            os.rename(temp_pdf, pdf_path)
-            return True
-        return False
-        
-    except Exception as e:
-        st.error(f"PDF conversion failed. Error: {str(e)}")
-        return False
-
-def validate_pdf(pdf_path: str) -> bool:
-    """Verify PDF is valid"""
+    
+    base_name = os.path.splitext(os.path.basename(docx_path))[0]
+    temp_pdf = os.path.join(scratch_dir, f"{base_name}.pdf")
+    
+    if not os.path.exists(temp_pdf):
+        raise RuntimeError("LibreOffice did not produce a PDF")
+    with open(temp_pdf, "rb") as f:
+        pdf_bytes = f.read()
+    # Check the PDF magic on the bytes already in memory
+    if not pdf_bytes.startswith(b"%PDF"):
+        raise RuntimeError("LibreOffice did not produce a valid PDF")
+    return pdf_bytes
+
+@lru_cache(maxsize=4)
+def load_template_bytes(template_path: str, mtime: float) -> bytes:
+    """Read the template once per path and modification time"""
+    with open(template_path, "rb") as f:
+        return f.read()
+
+@lru_cache(maxsize=4)
+def placeholder_locations(template_path: str, mtime: float) -> Tuple[tuple, tuple]:
+    """Find the paragraphs holding placeholders once per template version:
+    body paragraph indices and (table, row, cell, paragraph) coordinates"""
+    from docx import Document
+
+    doc = Document(io.BytesIO(load_template_bytes(template_path, mtime)))
+    body = tuple(i for i, paragraph in enumerate(doc.paragraphs) if "{{" in paragraph.text)
+    cells = tuple(
+        (t, r, c, p)
+        for t, table in enumerate(doc.tables)
+        for r, row in enumerate(table.rows)
+        for c, cell in enumerate(row.cells)
+        for p, paragraph in enumerate(cell.paragraphs)
+        if "{{" in paragraph.text
+    )
+    return body, cells
+
+def fill_placeholders(paragraph, replace) -> None:
+    """Substitute placeholders run by run to keep formatting, falling back to the whole paragraph when one spans runs"""
+    for run in paragraph.runs:
+        if "{{" in run.text:
+            run.text = PLACEHOLDER_RE.sub(replace, run.text)
+
+    text = paragraph.text
+    if "{{" in text:
+        new_text = PLACEHOLDER_RE.sub(replace, text)
+        if new_text != text:
+            paragraph.text = new_text
+
+def format_invoice_fields(row_data: dict) -> dict:
+    """Template values for one row (consolidate_data already emits strings
+    for most financial fields, only the numeric ones need formatting here)"""
+    return {
+        k: format(v, ".2f") if k in FINANCIAL_FIELDS and isinstance(v, NUMERIC_TYPES) else str(v)
+        for k, v in row_data.items()
+    }
+
+def render_invoice_pdf(
+    template_path: str,
+    row_data: dict,
+    invoice_number: int,
+    current_date: Optional[str] = None
+) -> Tuple[str, bytes]:
+    """Fill the template and convert it to PDF, returning (file name, PDF bytes).
+
+    Raises on failure and makes no Streamlit calls, so it is safe in worker threads.
+    """
+    from docx import Document
+    from docx.shared import Pt
+
+    # Parse from the cached bytes instead of reopening the template per invoice
+    mtime = os.path.getmtime(template_path)
+    template_bytes = load_template_bytes(template_path, mtime)
+    doc = Document(io.BytesIO(template_bytes))
+    style = doc.styles['Normal']
+    style.font.size = Pt(8)
+
+    formatted_data = format_invoice_fields(row_data)
+    
+    current_date = current_date or datetime.now().strftime("%Y-%m-%d")
+    formatted_data.update({
+        "DATE": current_date,
+        "INVOICE NUMBER": str(invoice_number),
+        "TRACKING NUMBER": str(row_data.get("TRACKING NUMBER", "")),
+        "TERMS": str(row_data.get("TERMS", "")),
+        "TOTAL QTY": str(row_data.get("TOTAL QTY", ""))
+    })
+
+    def replace(match):
+        key = match.group(1)
+        if key not in formatted_data and key.endswith("."):
+            key = key[:-1]
+        return formatted_data.get(key, match.group(0))
+
+    # Add invoice header
+    paragraphs = doc.paragraphs
+    if len(paragraphs) > 0:
+        first_para = paragraphs[0]
+        first_para.text = f"Invoice #: {invoice_number}\nDate: {current_date}\n" + first_para.text
+        for run in first_para.runs:
+            run.font.size = Pt(10)
+            run.bold = True
+
+    # Replace placeholders - including the rate - in one regex pass per text,
+    # visiting only the paragraphs the template scan found them in
+    body_locations, cell_locations = placeholder_locations(template_path, mtime)
+    for i in body_locations:
+        fill_placeholders(paragraphs[i], replace)
+
+    tables = doc.tables
+    row_cells = {}
+    for t, r, c, p in cell_locations:
+        if (t, r) not in row_cells:
+            row_cells[t, r] = tables[t].rows[r].cells
+        fill_placeholders(row_cells[t, r][c].paragraphs[p], replace)
+
+    # Generate filename
+    customer = sanitize_filename(formatted_data.get("MARK", "Customer"))
+    pdf_name = f"Invoice_{invoice_number}_{customer}.pdf"
+    
+    # Save and convert in a private scratch dir (usually tmpfs), so the
+    # intermediate files never touch the output disk and are always
+    # cleaned up, even when conversion fails
+    with tempfile.TemporaryDirectory(prefix="invoice_") as scratch_dir:
+        temp_docx = os.path.join(scratch_dir, f"temp_{invoice_number}.docx")
+        with open(temp_docx, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            doc.save(f)
+        return pdf_name, convert_docx_to_pdf(temp_docx)
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=RENDER_CACHE_ENTRIES)
+def _render_invoice(
+    template_path: str,
+    row_key: str,
+    invoice_number: int,
+    template_mtime: float,
+    current_date: str,
+    render_version: int,
+    _row_data: dict
+) -> Tuple[str, bytes]:
+    """render_invoice_pdf cached on the formatted row, so unchanged rows skip LibreOffice"""
+    return render_invoice_pdf(template_path, _row_data, invoice_number, current_date)
+
+def prune_render_cache() -> None:
+    """Drop persisted renders older than RENDER_CACHE_TTL and keep at most
+    RENDER_CACHE_ENTRIES; Streamlit applies neither to disk-persisted entries"""
     try:
-        with open(pdf_path, "rb") as f:
-            return f.read(4) == b"%PDF"
-    except:
-        return False
+        entries = [e for e in os.scandir(RENDER_CACHE_DIR) if e.name.endswith(".memo")]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    cutoff = time.time() - RENDER_CACHE_TTL
+    for i, entry in enumerate(entries):
+        if i >= RENDER_CACHE_ENTRIES or entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def render_invoice_cached(
+    template_path: str,
+    row_data: dict,
+    invoice_number: int
+) -> Tuple[str, bytes]:
+    """Render one invoice through the disk-persisted cache.
+
+    The key covers everything that ends up on the page: the formatted row,
+    the invoice number, the template version and the printed date, plus
+    RENDER_VERSION for the code that fills the template.
+    """
+    row_key = content_key(format_invoice_fields(row_data))
+    return _render_invoice(
+        template_path,
+        row_key,
+        invoice_number,
+        os.path.getmtime(template_path),
+        datetime.now().strftime("%Y-%m-%d"),
+        RENDER_VERSION,
+        row_data
+    )
 
 def generate_pdf_from_template(
     template_path: str,
@@ -61,178 +296,153 @@ def generate_pdf_from_template(
     output_folder: str,
     invoice_number: int
 ) -> Optional[str]:
-    """Generate PDF invoice from template"""
+    """Generate PDF invoice from template and save it in the output folder"""
     try:
-        doc = Document(template_path)
-        style = doc.styles['Normal']
-        style.font.size = Pt(8)
-
-        # Ensure all financial values are properly formatted
-        financial_fields = [
-            'PER CHARGES', 'PARKING CHARGES', 'TOTAL CHARGES', 
-            'TOTAL CHARGES_SUM', 'RATE', 'CALCULATED_CHARGES'
-        ]
-        
-        # Format values
-        formatted_data = {
-            k: f"{float(v):.2f}" if k in financial_fields and str(v).replace('.','',1).isdigit() else str(v)
-            for k, v in row_data.items()
-        }
-        
-        current_date = datetime.now().strftime("%Y-%m-%d")
-        formatted_data.update({
-            "DATE": current_date,
-            "INVOICE NUMBER": str(invoice_number),
-            "TRACKING NUMBER": row_data.get("TRACKING NUMBER", ""),
-            "TERMS": row_data.get("TERMS", ""),
-            "TOTAL QTY": row_data.get("TOTAL QTY", "")
-        })
-
-        # Add invoice header
-        if len(doc.paragraphs) > 0:
-            first_para = doc.paragraphs[0]
-            first_para.text = f"Invoice #: {invoice_number}\nDate: {current_date}\n" + first_para.text
-            for run in first_para.runs:
-                run.font.size = Pt(10)
-                run.bold = True
-
-        # Replace placeholders - including the rate
-        for paragraph in doc.paragraphs:
-            for key, value in formatted_data.items():
-                for ph in [f"{{{{{key}}}}}", f"{{{{{key}.}}}}"]:
-                    if ph in paragraph.text:
-                        paragraph.text = paragraph.text.replace(ph, value)
-
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for key, value in formatted_data.items():
-                        for ph in [f"{{{{{key}}}}}", f"{{{{{key}.}}}}"]:
-                            if ph in cell.text:
-                                cell.text = cell.text.replace(ph, value)
-
-        # Generate filename
-        customer = sanitize_filename(formatted_data.get("MARK", "Customer"))
-        pdf_name = f"Invoice_{invoice_number}_{customer}.pdf"
+        pdf_name, pdf_bytes = render_invoice_cached(template_path, row_data, invoice_number)
         pdf_path = os.path.join(output_folder, pdf_name)
-        
-        # Save and convert
-        temp_docx = os.path.join(output_folder, f"temp_{invoice_number}.docx")
-        doc.save(temp_docx)
-        
-        if convert_docx_to_pdf(temp_docx, pdf_path) and validate_pdf(pdf_path):
-            os.remove(temp_docx)
-            return pdf_path
-        
-        os.remove(temp_docx)
-        return None
-
+        with open(pdf_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            f.write(pdf_bytes)
+        return pdf_path
     except Exception as e:
         st.error(f"Template processing failed: {str(e)}")
         return None
 
-def update_notification_sheet(output_folder: str, pdf_name: str, customer: str, 
-                            invoice_number: int, contact: str, total: str):
-    """Update tracking spreadsheet"""
-    sheet_path = os.path.join(output_folder, "notification_log.xlsx")
-    new_data = pd.DataFrame([{
+def notification_entry(pdf_name: str, customer: str, invoice_number: int,
+                       contact: str, total: str) -> dict:
+    """One row of the tracking spreadsheet"""
+    return {
         "Customer": customer,
         "Invoice": invoice_number,
         "Contact": contact,
         "Amount": total,
         "File": pdf_name
-    }])
-    
+    }
+
+def update_notification_sheet(output_folder: str, entries: list):
+    """Append a batch of notification entries to the tracking spreadsheet in one write"""
+    from openpyxl import Workbook, load_workbook
+
+    sheet_path = os.path.join(output_folder, "notification_log.xlsx")
+    wb = None
     if os.path.exists(sheet_path):
         try:
-            existing = pd.read_excel(sheet_path)
-            updated = pd.concat([existing, new_data])
-            updated.to_excel(sheet_path, index=False)
-            return
-        except:
+            wb = load_workbook(sheet_path)
+        except Exception:
             pass
-    new_data.to_excel(sheet_path, index=False)
-
-def consolidate_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Process raw data into invoice-ready format with original calculation logic"""
-    consolidated = []
-    for customer, group in df.groupby("MARK"):
-        # Use session state defaults if they exist
-        per_charge = (
-            st.session_state.global_defaults['PER_CHARGES'] 
-            if st.session_state.global_defaults.get('applied', False)
-            else float(group["PER CHARGES"].iloc[0])
-        )
-        parking_charges = (
-            st.session_state.global_defaults['PARKING_CHARGES']
-            if st.session_state.global_defaults.get('applied', False)
-            else float(group["PARKING CHARGES"].iloc[0])
-        )
-        weight_rate = (
-            st.session_state.global_defaults['WEIGHT_RATE']
-            if st.session_state.global_defaults.get('applied', False)
-            else float(group["Weight Rate"].iloc[0]) if "Weight Rate" in group.columns else 1.0
-        )
-        
-                # Calculate CBM for each row (weight-based vs. measured)
-        group["Weight CBM"] = group["WEIGHT(KG)"] / weight_rate
-        group["Actual CBM"] = group[["MEAS.(CBM)", "Weight CBM"]].max(axis=1)
-        total_cbm = group["Actual CBM"].sum()
-        total_qty = group["QTY"].astype(float).sum()  # ✅ Add this line
-        # Calculate charges
-        if total_cbm < 0.05:
-            calculated_charges = 10.00  # Flat rate
-            rate_applied = 10.00
-        else:
-            calculated_charges = (group["Actual CBM"] * per_charge).sum()
-            rate_applied = per_charge
+    if wb is None:
+        wb = Workbook()
+        wb.active.append(NOTIFICATION_COLUMNS)
+
+    # Append rows to the existing sheet
+    ws = wb.active
+    for entry in entries:
+        ws.append([entry[col] for col in NOTIFICATION_COLUMNS])
+    with open(sheet_path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        wb.save(f)
+
+
+@st.cache_data(show_spinner=False)
+def load_excel(file_bytes: bytes) -> pd.DataFrame:
+    """Parse the uploaded workbook once per distinct file instead of on every rerun"""
+    # calamine parses in Rust and reads .xls as well as .xlsx
+    df = pd.read_excel(io.BytesIO(file_bytes), engine="calamine")
+
+    # Store repeated customer fields as categoricals so raw_df keeps
+    # one copy of each string; numeric columns stay float64 because
+    # their string form ends up on the invoices
+    category_cols = [c for c in CATEGORY_COLUMNS if c in df.columns]
+    df[category_cols] = df[category_cols].astype("category")
+    return df
+
+def consolidate_data(df: pd.DataFrame, defaults: Optional[dict] = None) -> pd.DataFrame:
+    """Process raw data into invoice-ready format with calculation logic"""
+    defaults = defaults or {}
+    use_defaults = defaults.get("applied", False)
+
+    # Group number of every item row; rows without a MARK (NaN, or -1 on
+    # older pandas) are dropped
+    codes = df.groupby("MARK", observed=True).ngroup().to_numpy()
+    has_mark = codes >= 0
+    marked = df if has_mark.all() else df[has_mark]
+    codes = codes[has_mark].astype(np.intp)
+
+    # First item row of each customer, in group order
+    _, first_pos = np.unique(codes, return_index=True)
+    first = marked.iloc[first_pos]
+
+    # Use the global defaults if they were applied
+    per_charge = first["PER CHARGES"].astype(float).to_numpy()
+    parking_charges = first["PARKING CHARGES"].astype(float).to_numpy()
+    weight_rate = first["Weight Rate"].astype(float).to_numpy()
+    if use_defaults:
+        per_charge = np.full(len(first), defaults.get("PER_CHARGES", np.nan), dtype=float)
+        parking_charges = np.full(len(first), defaults.get("PARKING_CHARGES", np.nan), dtype=float)
+        weight_rate = np.full(len(first), defaults.get("WEIGHT_RATE", np.nan), dtype=float)
+
+    # Calculate CBM per item row with the customer's weight rate
+    # (fmax ignores a NaN on either side)
+    weight_cbm = marked["WEIGHT(KG)"].astype(float).to_numpy() / weight_rate[codes]
+    actual_cbm = np.fmax(marked["MEAS.(CBM)"].astype(float).to_numpy(), weight_cbm)
+
+    sums = pd.DataFrame({
+        "cbm": actual_cbm,
+        "qty": marked["QTY"].astype(float).to_numpy(),
+        "charges": actual_cbm * per_charge[codes],
+    }).groupby(codes).sum()
+    total_cbm = sums["cbm"].to_numpy()
+    total_qty = sums["qty"].to_numpy()
+
+    flat_rate = total_cbm < 0.05
+    calculated_charges = np.where(flat_rate, 10.00, sums["charges"].to_numpy())
+    rate_applied = np.where(flat_rate, 10.00, per_charge)
+    total_charges = calculated_charges + parking_charges
+
+    # Multi-line fields, joined for every customer in one grouped pass
+    fields = ["RECEIPT NO.", "QTY", "DESCRIPTION", "CBM", "WEIGHT(KG)"]
+    joined = marked[fields].astype(str).groupby(codes).agg("\n".join)
+
+    text_fields = ["CONTACT NUMBER", "CARGO NUMBER", "TRACKING NUMBER", "TERMS", "业务员/ Supplier"]
+    first_text = {
+        f: first[f].to_numpy(dtype=object).astype(str) if f in first.columns else ""
+        for f in text_fields
+    }
+
+    return pd.DataFrame({
+        **{f: joined[f].to_numpy() for f in fields},
+        "PARKING CHARGES": np.char.mod("%.2f", parking_charges),
+        "PER CHARGES": np.char.mod("%.2f", rate_applied),
+        "RATE": np.char.mod("%.2f", rate_applied),
+        "Weight Rate": np.char.mod("%.2f", weight_rate),
+        "TOTAL CHARGES": np.char.mod("%.2f", total_charges),
+        "MARK": first["MARK"].to_numpy(),
+        **first_text,
+        "TOTAL QTY": np.char.mod("%.2f", total_qty),
+        "TOTAL CBM": np.char.mod("%.2f", total_cbm),
+        "TOTAL CHARGES_SUM": total_charges,
+        "FLAT_RATE_APPLIED": np.where(flat_rate, "Yes", "No"),
+        "CALCULATED_CHARGES": calculated_charges,
+        # preserve numeric total CBM
+        "NUM_TOTAL_CBM": total_cbm
+    })
+
+@st.cache_data(show_spinner=False)
+def consolidate_cached(df_key: str, _df: pd.DataFrame, defaults: dict) -> pd.DataFrame:
+    """consolidate_data cached on the content hash of the raw frame and the global defaults"""
+    return consolidate_data(_df, defaults)
 
-        total_charges = calculated_charges + parking_charges
-        total_charges = calculated_charges + parking_charges
-        first_row = group.iloc[0]
-        
-        # Multi-line fields
-        fields = ["RECEIPT NO.", "QTY", "DESCRIPTION", "CBM", "WEIGHT(KG)"]
-        joined = {f: "\n".join(group[f].astype(str)) for f in fields}
-        
-        # Build record with all required fields including rate
-        consolidated.append({
-            **joined,
-            "PARKING CHARGES": f"{parking_charges:.2f}",
-            "PER CHARGES": f"{rate_applied:.2f}",
-            "RATE": f"{rate_applied:.2f}",
-            "Weight Rate": f"{weight_rate:.2f}",
-            "TOTAL CHARGES": f"{total_charges:.2f}",
-            "MARK": customer,
-            "CONTACT NUMBER": str(first_row.get("CONTACT NUMBER", "")),
-            "CARGO NUMBER": str(first_row.get("CARGO NUMBER", "")),
-            "TRACKING NUMBER": str(first_row.get("TRACKING NUMBER", "")),
-            "业务员/ Supplier": str(first_row.get("业务员/ Supplier", "")),
-            "TERMS": str(first_row.get("TERMS", "")),
-            "TOTAL QTY": f"{total_qty:.2f}",
-            "TOTAL CBM": f"{total_cbm:.2f}",
-            "TOTAL CHARGES_SUM": f"{total_charges:.2f}",
-            "FLAT_RATE_APPLIED": "Yes" if total_cbm < 0.05 else "No",
-            "CALCULATED_CHARGES": calculated_charges
-        })
-    return pd.DataFrame(consolidated)
-
-
-def create_download_link(file_path: str, label: str) -> str:
-    """Generate HTML download link"""
-    with open(file_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    return f'<a href="data:application/octet-stream;base64,{b64}" download="{os.path.basename(file_path)}">{label}</a>'
-    
 def display_customer_markdowns(df: pd.DataFrame):
     """Display formatted markdown for each customer with editing capability"""
     st.header("📋 Customer Summaries & Editing")
 
-    edited_df = df.copy()
+    # Edits are only applied from the submitted form below, so no copy is needed
+    edited_df = df
+
+    # One record per customer up front instead of a full-frame mask scan per expander
+    customer_records = edited_df.drop_duplicates("MARK").to_dict("records")
 
-    for idx, customer in enumerate(edited_df["MARK"].unique()):
+    for idx, customer_data in enumerate(customer_records):
+        customer = customer_data["MARK"]
         with st.expander(f"📌 {customer}", expanded=False):
-            customer_data = edited_df[edited_df["MARK"] == customer].iloc[0]
 
             # Safe float conversion
             per_charges = float(customer_data.get('PER CHARGES', 0))
@@ -259,233 +469,82 @@ def display_customer_markdowns(df: pd.DataFrame):
             **Flat Rate Applied:** {"Yes" if total_cbm < 0.05 else "No"}
             """)
 
-            # Editable fields
-            cols = st.columns(4)
-            with cols[0]:
-                new_per_charges = st.number_input("Per Charges ($/CBM)", value=per_charges, min_value=0.0, step=0.1, key=f"per_charges_{idx}")
-            with cols[1]:
-                new_parking = st.number_input("Parking Charges ($)", value=parking_charges, min_value=0.0, step=0.1, key=f"parking_{idx}")
-            with cols[2]:
-                new_weight_rate = st.number_input("Weight Rate (kg/CBM)", value=weight_rate, min_value=0.1, step=0.1, key=f"weight_rate_{idx}")
-            with cols[3]:
-                new_terms = st.text_input("Terms", value=str(customer_data.get('TERMS', '')), key=f"terms_{idx}")
-
-            cols2 = st.columns(2)
-            with cols2[0]:
-                new_tracking = st.text_input("Tracking Number", value=str(customer_data.get('TRACKING NUMBER', '')), key=f"tracking_{idx}")
-            with cols2[1]:
-                new_contact = st.text_input("Contact Number", value=str(customer_data.get('CONTACT NUMBER', '')), key=f"contact_{idx}")
-
-            if st.button(f"💾 Save Changes for {customer}", key=f"save_{idx}"):
-                mask = edited_df["MARK"] == customer
-
-                # Update edited fields
-                edited_df.loc[mask, "PER CHARGES"] = float(new_per_charges)
-                edited_df.loc[mask, "PARKING CHARGES"] = float(new_parking)
-                edited_df.loc[mask, "Weight Rate"] = float(new_weight_rate)
-                edited_df.loc[mask, "TERMS"] = new_terms
-                edited_df.loc[mask, "TRACKING NUMBER"] = new_tracking
-                edited_df.loc[mask, "CONTACT NUMBER"] = new_contact
-
-                try:
-                    original_df = st.session_state.raw_df
-                    customer_rows = original_df[original_df["MARK"] == customer].copy()
-
-                    customer_rows["WEIGHT(KG)"] = customer_rows["WEIGHT(KG)"].astype(float)
-                    customer_rows["MEAS.(CBM)"] = customer_rows["MEAS.(CBM)"].astype(float)
-
-                    weight_cbm = customer_rows["WEIGHT(KG)"] / float(new_weight_rate)
-                    actual_cbm = pd.concat([customer_rows["MEAS.(CBM)"], weight_cbm], axis=1).max(axis=1)
-                    current_cbm = actual_cbm.sum()
-
-                    edited_df.loc[mask, "NUM_TOTAL_CBM"] = current_cbm
-                    edited_df.loc[mask, "TOTAL CBM"] = f"{current_cbm:.2f}"
-
-                except Exception as e:
-                    st.warning(f"CBM recalculation failed: {e}")
-                    current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
-
-                # Charges update
-                current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
-                if current_cbm < 0.05:
-                    calculated_charges = 10.00
-                else:
-                    calculated_charges = current_cbm * float(new_per_charges)
-
-                total_charges = calculated_charges + float(new_parking)
-
-                edited_df.loc[mask, "TOTAL CHARGES_SUM"] = total_charges
-                edited_df.loc[mask, "TOTAL CHARGES"] = f"{total_charges:.2f}"
-                edited_df.loc[mask, "FLAT_RATE_APPLIED"] = "Yes" if current_cbm < 0.05 else "No"
-                edited_df.loc[mask, "RATE"] = f"{10.00:.2f}" if current_cbm < 0.05 else f"{new_per_charges:.2f}"
-
-                # Save changes
-                st.session_state.consolidated_df = edited_df
-                st.success(f"✅ Changes saved and recalculated for {customer}!")
-                st.rerun()
-
-
-def consolidate_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Process raw data into invoice-ready format with calculation logic"""
-    consolidated = []
-    for customer, group in df.groupby("MARK"):
-        # Use session state defaults if they exist
-        defaults = st.session_state.get("global_defaults", {})
-        use_defaults = defaults.get("applied", False)
-
-        per_charge = defaults.get("PER_CHARGES", float(group["PER CHARGES"].iloc[0])) if use_defaults else float(group["PER CHARGES"].iloc[0])
-        parking_charges = defaults.get("PARKING_CHARGES", float(group["PARKING CHARGES"].iloc[0])) if use_defaults else float(group["PARKING CHARGES"].iloc[0])
-        weight_rate = defaults.get("WEIGHT_RATE", float(group["Weight Rate"].iloc[0])) if use_defaults else float(group["Weight Rate"].iloc[0])
-
-        # Calculate CBM
-        group["Weight CBM"] = group["WEIGHT(KG)"].astype(float) / weight_rate
-        group["Actual CBM"] = group[["MEAS.(CBM)", "Weight CBM"]].astype(float).max(axis=1)
-        total_cbm = group["Actual CBM"].sum()
-        total_qty = group["QTY"].astype(float).sum()
-
-        if total_cbm < 0.05:
-            calculated_charges = 10.00
-            rate_applied = 10.00
-        else:
-            calculated_charges = (group["Actual CBM"] * per_charge).sum()
-            rate_applied = per_charge
-
-        total_charges = calculated_charges + parking_charges
-
-        first_row = group.iloc[0]
-        fields = ["RECEIPT NO.", "QTY", "DESCRIPTION", "CBM", "WEIGHT(KG)"]
-        joined = {f: "\n".join(group[f].astype(str)) for f in fields}
-
-        consolidated.append({
-            **joined,
-            "PARKING CHARGES": f"{parking_charges:.2f}",
-            "PER CHARGES": f"{rate_applied:.2f}",
-            "RATE": f"{rate_applied:.2f}",
-            "Weight Rate": f"{weight_rate:.2f}",
-            "TOTAL CHARGES": f"{total_charges:.2f}",
-            "MARK": customer,
-            "CONTACT NUMBER": str(first_row.get("CONTACT NUMBER", "")),
-            "CARGO NUMBER": str(first_row.get("CARGO NUMBER", "")),
-            "TRACKING NUMBER": str(first_row.get("TRACKING NUMBER", "")),
-            "TERMS": str(first_row.get("TERMS", "")),
-            "业务员/ Supplier": str(first_row.get("业务员/ Supplier", "")),
-            "TOTAL QTY": f"{total_qty:.2f}",
-            "TOTAL CBM": f"{total_cbm:.2f}",
-            "TOTAL CHARGES_SUM": total_charges,
-            "FLAT_RATE_APPLIED": "Yes" if total_cbm < 0.05 else "No",
-            "CALCULATED_CHARGES": calculated_charges,
-            # preserve numeric total CBM
-            "NUM_TOTAL_CBM": total_cbm
-        })
-    return pd.DataFrame(consolidated)
-
-def create_download_link(file_path: str, label: str) -> str:
-    """Generate HTML download link"""
-    with open(file_path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode()
-    return f'<a href="data:application/octet-stream;base64,{b64}" download="{os.path.basename(file_path)}">{label}</a>'
-
-def display_customer_markdowns(df: pd.DataFrame):
-    """Display formatted markdown for each customer with editing capability"""
-    st.header("📋 Customer Summaries & Editing")
+            # Widgets inside a form only trigger a rerun on submit
+            with st.form(key=f"cust_form_{idx}"):
+                # Editable fields
+                cols = st.columns(4)
+                with cols[0]:
+                    new_per_charges = st.number_input("Per Charges ($/CBM)", value=per_charges, min_value=0.0, step=0.1, key=f"per_charges_{idx}")
+                with cols[1]:
+                    new_parking = st.number_input("Parking Charges ($)", value=parking_charges, min_value=0.0, step=0.1, key=f"parking_{idx}")
+                with cols[2]:
+                    new_weight_rate = st.number_input("Weight Rate (kg/CBM)", value=weight_rate, min_value=0.1, step=0.1, key=f"weight_rate_{idx}")
+                with cols[3]:
+                    new_terms = st.text_input("Terms", value=str(customer_data.get('TERMS', '')), key=f"terms_{idx}")
+
+                cols2 = st.columns(2)
+                with cols2[0]:
+                    new_tracking = st.text_input("Tracking Number", value=str(customer_data.get('TRACKING NUMBER', '')), key=f"tracking_{idx}")
+                with cols2[1]:
+                    new_contact = st.text_input("Contact Number", value=str(customer_data.get('CONTACT NUMBER', '')), key=f"contact_{idx}")
+
+                # Submit button applies the edits
+                if st.form_submit_button(f"💾 Save Changes for {customer}"):
+                    mask = edited_df["MARK"] == customer
+
+                    # Update edited fields
+                    edited_df.loc[mask, "PER CHARGES"] = float(new_per_charges)
+                    edited_df.loc[mask, "PARKING CHARGES"] = float(new_parking)
+                    edited_df.loc[mask, "Weight Rate"] = float(new_weight_rate)
+                    edited_df.loc[mask, "TERMS"] = new_terms
+                    edited_df.loc[mask, "TRACKING NUMBER"] = new_tracking
+                    edited_df.loc[mask, "CONTACT NUMBER"] = new_contact
+
+                    # Recalculate NUM_TOTAL_CBM based on new weight rate
+                    try:
+                        original_df = st.session_state.raw_df
+                        customer_rows = original_df[original_df["MARK"] == customer].copy()
+
+                        customer_rows["WEIGHT(KG)"] = customer_rows["WEIGHT(KG)"].astype(float)
+                        customer_rows["MEAS.(CBM)"] = customer_rows["MEAS.(CBM)"].astype(float)
+
+                        weight_cbm = customer_rows["WEIGHT(KG)"] / float(new_weight_rate)
+                        actual_cbm = pd.concat([customer_rows["MEAS.(CBM)"], weight_cbm], axis=1).max(axis=1)
+                        current_cbm = actual_cbm.sum()
+
+                        edited_df.loc[mask, "NUM_TOTAL_CBM"] = current_cbm
+                        edited_df.loc[mask, "TOTAL CBM"] = f"{current_cbm:.2f}"
+
+                    except Exception as e:
+                        st.warning(f"CBM recalculation failed: {e}")
+                        current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
 
-    edited_df = df.copy()
-
-    for idx, customer in enumerate(edited_df["MARK"].unique()):
-        with st.expander(f"📌 {customer}", expanded=False):
-            customer_data = edited_df[edited_df["MARK"] == customer].iloc[0]
-
-            # Safe float conversion
-            per_charges = float(customer_data.get('PER CHARGES', 0))
-            parking_charges = float(customer_data.get('PARKING CHARGES', 0))
-            total_cbm = float(customer_data.get('NUM_TOTAL_CBM', 0))  # use numeric CBM
-            weight_rate = float(customer_data.get('Weight Rate', 1))
-
-            # Recalculate charges
-            if total_cbm < 0.05:
-                calculated_charges = 10.00
-            else:
-                calculated_charges = total_cbm * per_charges
-            total_charges = calculated_charges + parking_charges
+                    current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
+                    if current_cbm < 0.05:
+                        calculated_charges = 10.00
+                    else:
+                        calculated_charges = current_cbm * float(new_per_charges)
 
-            st.markdown(f"""
-            **Customer:** {customer}  
-            **Contact:** {customer_data.get('CONTACT NUMBER', 'N/A')}  
-            **Total Items:** {customer_data.get('TOTAL QTY', 'N/A')}  
-            **Total CBM:** {total_cbm:.2f}  
-            **Weight Rate:** {weight_rate:.2f}  
-            **Total Charges:** ${total_charges:.2f}  
-            **Tracking Number:** {customer_data.get('TRACKING NUMBER', 'N/A')}  
-            **Terms:** {customer_data.get('TERMS', 'N/A')}  
-            **Flat Rate Applied:** {"Yes" if total_cbm < 0.05 else "No"}
-            """)
+                    total_charges = calculated_charges + float(new_parking)
 
-            # Editable fields
-            cols = st.columns(4)
-            with cols[0]:
-                new_per_charges = st.number_input("Per Charges ($/CBM)", value=per_charges, min_value=0.0, step=0.1, key=f"per_charges_{idx}")
-            with cols[1]:
-                new_parking = st.number_input("Parking Charges ($)", value=parking_charges, min_value=0.0, step=0.1, key=f"parking_{idx}")
-            with cols[2]:
-                new_weight_rate = st.number_input("Weight Rate (kg/CBM)", value=weight_rate, min_value=0.1, step=0.1, key=f"weight_rate_{idx}")
-            with cols[3]:
-                new_terms = st.text_input("Terms", value=str(customer_data.get('TERMS', '')), key=f"terms_{idx}")
-
-            cols2 = st.columns(2)
-            with cols2[0]:
-                new_tracking = st.text_input("Tracking Number", value=str(customer_data.get('TRACKING NUMBER', '')), key=f"tracking_{idx}")
-            with cols2[1]:
-                new_contact = st.text_input("Contact Number", value=str(customer_data.get('CONTACT NUMBER', '')), key=f"contact_{idx}")
-
-            # Save button inside expander
-            if st.button(f"💾 Save Changes for {customer}", key=f"save_{idx}"):
-                mask = edited_df["MARK"] == customer
-
-                # Update edited fields
-                edited_df.loc[mask, "PER CHARGES"] = float(new_per_charges)
-                edited_df.loc[mask, "PARKING CHARGES"] = float(new_parking)
-                edited_df.loc[mask, "Weight Rate"] = float(new_weight_rate)
-                edited_df.loc[mask, "TERMS"] = new_terms
-                edited_df.loc[mask, "TRACKING NUMBER"] = new_tracking
-                edited_df.loc[mask, "CONTACT NUMBER"] = new_contact
-
-                # Recalculate NUM_TOTAL_CBM based on new weight rate
-                try:
-                    original_df = st.session_state.raw_df
-                    customer_rows = original_df[original_df["MARK"] == customer].copy()
-
-                    customer_rows["WEIGHT(KG)"] = customer_rows["WEIGHT(KG)"].astype(float)
-                    customer_rows["MEAS.(CBM)"] = customer_rows["MEAS.(CBM)"].astype(float)
-
-                    weight_cbm = customer_rows["WEIGHT(KG)"] / float(new_weight_rate)
-                    actual_cbm = pd.concat([customer_rows["MEAS.(CBM)"], weight_cbm], axis=1).max(axis=1)
-                    current_cbm = actual_cbm.sum()
-
-                    edited_df.loc[mask, "NUM_TOTAL_CBM"] = current_cbm
-                    edited_df.loc[mask, "TOTAL CBM"] = f"{current_cbm:.2f}"
-
-                except Exception as e:
-                    st.warning(f"CBM recalculation failed: {e}")
-                    current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
+                    edited_df.loc[mask, "TOTAL CHARGES_SUM"] = total_charges
+                    edited_df.loc[mask, "TOTAL CHARGES"] = f"{total_charges:.2f}"
+                    edited_df.loc[mask, "FLAT_RATE_APPLIED"] = "Yes" if current_cbm < 0.05 else "No"
+                    edited_df.loc[mask, "RATE"] = f"{10.00:.2f}" if current_cbm < 0.05 else f"{new_per_charges:.2f}"
 
-                current_cbm = float(edited_df.loc[mask, "NUM_TOTAL_CBM"].values[0])
-                if current_cbm < 0.05:
-                    calculated_charges = 10.00
-                else:
-                    calculated_charges = current_cbm * float(new_per_charges)
+                    set_consolidated_df(edited_df)
+                    st.success(f"Changes saved for {customer}!")
+                    st.rerun()
 
-                total_charges = calculated_charges + float(new_parking)
+    return edited_df
 
-                edited_df.loc[mask, "TOTAL CHARGES_SUM"] = total_charges
-                edited_df.loc[mask, "TOTAL CHARGES"] = f"{total_charges:.2f}"
-                edited_df.loc[mask, "FLAT_RATE_APPLIED"] = "Yes" if current_cbm < 0.05 else "No"
-                edited_df.loc[mask, "RATE"] = f"{10.00:.2f}" if current_cbm < 0.05 else f"{new_per_charges:.2f}"
 
-                st.session_state.consolidated_df = edited_df
-                st.success(f"Changes saved for {customer}!")
-                st.rerun()
+@st.cache_data(show_spinner=False)
+def build_packing_list(df_key: str, _df: pd.DataFrame) -> bytes:
+    """Build the packing list workbook, cached on the content hash of the frame"""
+    from packing_list_export import export_custom_packing_list
 
-    return edited_df
+    return export_custom_packing_list(_df).getvalue()
 
 
 def display_customer_editor():
@@ -496,15 +555,15 @@ def display_customer_editor():
     
     st.subheader("📥 Download Packing List Print")
 
-    # ✅ Packing list download
-    if st.button("Create & Download Excel"):
-        xls_buffer = export_custom_packing_list(st.session_state.consolidated_df)
-        st.download_button(
-            label="⬇️ Download Packing_List_Print.xlsx",
-            data=xls_buffer,
-            file_name="Packing_List_Print.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    # ✅ Packing list download (only rebuilt when the data changes)
+    consolidated = st.session_state.consolidated_df
+    df_key = frame_key(consolidated)
+    st.download_button(
+        label="⬇️ Download Packing_List_Print.xlsx",
+        data=build_packing_list(df_key, consolidated),
+        file_name="Packing_List_Print.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
 
     # Display editable table (disable some columns)
     edited_df = st.data_editor(
@@ -519,11 +578,11 @@ def display_customer_editor():
 
     if st.button("💾 Save Table Changes"):
         # Pull raw data for accurate recalculation
-        raw_df = st.session_state.raw_df.copy()
+        raw_df = st.session_state.raw_df
 
         # For each customer, update the original data with new editable values
         updated_records = []
-        for _, row in edited_df.iterrows():
+        for row in edited_df.to_dict(orient="records"):
             customer = row["MARK"]
             per_charges = float(row["PER CHARGES"])
             parking = float(row["PARKING CHARGES"])
@@ -556,7 +615,7 @@ def display_customer_editor():
             joined = {}
             for f in fields:
                 if f == "CBM":
-                    joined[f] = "\n".join(actual_cbm.round(3).astype(str))
+                    joined[f] = "\n".join(np.char.mod("%.3f", actual_cbm.to_numpy()).tolist())
                 elif f in customer_rows.columns:
                     joined[f] = "\n".join(customer_rows[f].astype(str))
                 else:
@@ -584,12 +643,25 @@ def display_customer_editor():
             })
 
         # Save back to session
-        st.session_state.consolidated_df = pd.DataFrame(updated_records)
+        set_consolidated_df(pd.DataFrame(updated_records))
         st.success("✅ Table updated and recalculated successfully.")
         st.rerun()
 
 
+def set_consolidated_df(df: Optional[pd.DataFrame]):
+    """Store the consolidated table with the customer list derived from it"""
+    st.session_state.consolidated_df = df
+    st.session_state.customer_list = [] if df is None else df["MARK"].unique().tolist()
+
+
+def mark_consolidated_dirty():
+    """Widget callback: rebuild consolidated_df on the next run instead of every run"""
+    st.session_state.consolidated_dirty = True
+
+
 def main():
+    import shutil
+
     st.title("📄 Invoice Generation System")
     
     # Initialize session state
@@ -601,14 +673,17 @@ def main():
             'applied': False
         }
     if 'consolidated_df' not in st.session_state:
-        st.session_state.consolidated_df = None
+        set_consolidated_df(None)
+    if 'consolidated_dirty' not in st.session_state:
+        st.session_state.consolidated_dirty = True
     
     # Sidebar functions
     st.sidebar.header("⚙️ Quick Actions")
     st.sidebar.markdown("[📝 Sample Excel Template](#)")
     
     if st.sidebar.button("🔄 Clear All Data"):
-        st.session_state.consolidated_df = None
+        set_consolidated_df(None)
+        st.session_state.consolidated_dirty = True
         st.session_state.global_defaults = {
             'PER_CHARGES': None,
             'WEIGHT_RATE': None,
@@ -618,6 +693,7 @@ def main():
         if os.path.exists(OUTPUT_FOLDER):
             shutil.rmtree(OUTPUT_FOLDER)
         os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+        _render_invoice.clear()
         st.rerun()
     
     if st.sidebar.button("ℹ️ Help"):
@@ -630,11 +706,14 @@ def main():
         """)
 
     # File Upload
-    uploaded_file = st.file_uploader("📤 Upload Excel File", type=["xlsx", "xls"])
+    uploaded_file = st.file_uploader(
+        "📤 Upload Excel File",
+        type=["xlsx", "xls"],
+        on_change=mark_consolidated_dirty
+    )
     if uploaded_file:
         try:
-            df = pd.read_excel(uploaded_file)
-            
+            df = load_excel(uploaded_file.getvalue())
             st.session_state.raw_df = df.copy()
 
             # Initialize missing columns with session state defaults if they exist
@@ -668,32 +747,39 @@ def main():
         except Exception as e:
             st.error(f"Error processing file: {e}")
             
+        # The file's own first-row settings, read once per upload
+        if st.session_state.consolidated_dirty or 'file_defaults' not in st.session_state:
+            first = df.iloc[0] if len(df) else {}
+            st.session_state.file_defaults = {
+                'PER_CHARGES': float(first.get("PER CHARGES", 0.0)),
+                'WEIGHT_RATE': float(first.get("Weight Rate", 1.0)),
+                'PARKING_CHARGES': float(first.get("PARKING CHARGES", 0.0))
+            }
+        file_defaults = st.session_state.file_defaults
+
         # Global Settings UI
         st.header("⚙️ Global Settings")
         col1, col2, col3 = st.columns(3)
         with col1:
-            current_per_charge = float(df["PER CHARGES"].iloc[0])
             default_per_charge = st.number_input(
                 "Default Per Charge ($/CBM)",
-                value=st.session_state.global_defaults['PER_CHARGES'] or current_per_charge,
+                value=st.session_state.global_defaults['PER_CHARGES'] or file_defaults['PER_CHARGES'],
                 min_value=0.0,
                 step=0.1,
                 key="global_per_charge"
             )
         with col2:
-            current_weight_rate = float(df["Weight Rate"].iloc[0])
             default_weight_rate = st.number_input(
                 "Default Weight Rate (kg/CBM)",
-                value=st.session_state.global_defaults['WEIGHT_RATE'] or current_weight_rate,
+                value=st.session_state.global_defaults['WEIGHT_RATE'] or file_defaults['WEIGHT_RATE'],
                 min_value=0.1,
                 step=0.1,
                 key="global_weight_rate"
             )
         with col3:
-            current_parking = float(df["PARKING CHARGES"].iloc[0])
             default_parking = st.number_input(
                 "Default Parking Charge ($)",
-                value=st.session_state.global_defaults['PARKING_CHARGES'] or current_parking,
+                value=st.session_state.global_defaults['PARKING_CHARGES'] or file_defaults['PARKING_CHARGES'],
                 min_value=0.0,
                 step=0.1,
                 key="global_parking"
@@ -706,12 +792,29 @@ def main():
                 'PARKING_CHARGES': default_parking,
                 'applied': True
             }
+            mark_consolidated_dirty()
             st.success("Global settings applied to all customers!")
         
-        # Process data with original calculation logic
-        df["Weight CBM"] = df["WEIGHT(KG)"] / df["Weight Rate"]
-        df["CBM"] = df[["MEAS.(CBM)", "Weight CBM"]].max(axis=1)
-        st.session_state.consolidated_df = consolidate_data(df)
+        # Process data with original calculation logic, only when a new file
+        # or new global settings made the consolidated table stale, so other
+        # widget interactions don't redo it (or discard the user's edits)
+        if st.session_state.consolidated_dirty or st.session_state.consolidated_df is None:
+            # Volumetric CBM from weight (0 without a usable rate), and the
+            # larger of that and the measured CBM, ignoring missing values
+            weight_rate = df["Weight Rate"].to_numpy(dtype=float)
+            has_rate = weight_rate > 0
+            weight_cbm = np.where(
+                has_rate,
+                df["WEIGHT(KG)"].to_numpy(dtype=float) / np.where(has_rate, weight_rate, 1.0),
+                0.0
+            )
+            df["Weight CBM"] = weight_cbm
+            df["CBM"] = np.nan_to_num(np.fmax(df["MEAS.(CBM)"].to_numpy(dtype=float), weight_cbm))
+            df_key = frame_key(df)
+            set_consolidated_df(consolidate_cached(
+                df_key, df, st.session_state.global_defaults
+            ))
+            st.session_state.consolidated_dirty = False
         
         # Choose editing method
         st.subheader("✏️ Customer Editing Mode")
@@ -722,9 +825,11 @@ def main():
         else:
             display_customer_markdowns(st.session_state.consolidated_df)
         
-        # Display processed table
+        # Display processed table on request; sending the whole frame to
+        # the browser on every rerun is wasted work while editing
         st.header("📊 Processed Data")
-        st.dataframe(st.session_state.consolidated_df)
+        if st.checkbox("Show Processed Data Preview", value=False, key="show_preview"):
+            st.dataframe(st.session_state.consolidated_df)
         
         # Invoice Generation
         st.header("🖨️ Invoice Generation")
@@ -736,8 +841,7 @@ def main():
         )
         # Exclusion option before generating all invoices
         st.subheader("🙅‍♂️ Exclude Customers from Invoice Generation")
-        all_customers = st.session_state.consolidated_df["MARK"].unique().tolist()
-        excluded_customers = st.multiselect("Select customers to exclude from 'Generate All Invoices'", options=all_customers, key="exclude_customers")
+        excluded_customers = st.multiselect("Select customers to exclude from 'Generate All Invoices'", options=st.session_state.customer_list, key="exclude_customers")
 
         
         
@@ -745,48 +849,76 @@ def main():
             if os.path.exists(OUTPUT_FOLDER):
                 shutil.rmtree(OUTPUT_FOLDER)
             os.makedirs(OUTPUT_FOLDER)
+            prune_render_cache()
             
             progress_bar = st.progress(0)
             status_text = st.empty()
             
         
             included_df = st.session_state.consolidated_df[~st.session_state.consolidated_df["MARK"].isin(excluded_customers)].reset_index(drop=True)
-            for i, (_, row) in enumerate(included_df.iterrows()):
-    
-                status_text.text(f"Processing {i+1}/{len(st.session_state.consolidated_df)}: {row['MARK']}")
-                progress_bar.progress((i + 1) / len(st.session_state.consolidated_df))
-                
-                pdf_path = generate_pdf_from_template(
-                    TEMPLATE_PATH,
-                    row.to_dict(),
-                    OUTPUT_FOLDER,
-                    start_num + i
-                )
-                
-                if pdf_path:
-                    update_notification_sheet(
-                        OUTPUT_FOLDER,
-                        os.path.basename(pdf_path),
-                        row["MARK"],
-                        start_num + i,
-                        row["CONTACT NUMBER"],
-                        row["TOTAL CHARGES_SUM"]
-                    )
-            
-            # Create ZIP archive
+            tasks = [
+                (row, start_num + i)
+                for i, row in enumerate(included_df.to_dict(orient="records"))
+            ]
+            notification_rows = []
+
+            # Render invoices in parallel; threads are enough because each
+            # worker mostly waits on its own LibreOffice process. Streamlit
+            # calls, the ZIP and the notification sheet stay on this thread.
+            # PDFs go straight into the archive instead of being written to
+            # the output folder and read back. Only PDF_QUEUE_SIZE renders are
+            # queued at a time, and each finished one is dropped once it is in
+            # the archive, so memory stays flat however large the batch is.
+            import zipfile
+
             zip_path = os.path.join(OUTPUT_FOLDER, "invoices.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                for file in os.listdir(OUTPUT_FOLDER):
-                    if file.endswith('.pdf'):
-                        zipf.write(
-                            os.path.join(OUTPUT_FOLDER, file), 
-                            file
-                        )
+            with ThreadPoolExecutor(max_workers=PDF_WORKERS) as executor, \
+                    open(zip_path, "wb", buffering=WRITE_BUFFER_SIZE) as zip_file, \
+                    zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as zipf:
+                remaining = iter(tasks)
+                pending = {}
+                done = 0
+                while True:
+                    for row, invoice_number in islice(remaining, PDF_QUEUE_SIZE - len(pending)):
+                        future = executor.submit(render_invoice_cached, TEMPLATE_PATH, row, invoice_number)
+                        pending[future] = (row, invoice_number)
+                    if not pending:
+                        break
+
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        row, invoice_number = pending.pop(future)
+                        done += 1
+                        status_text.text(f"Processing {done}/{len(tasks)}: {row['MARK']}")
+                        progress_bar.progress(done / len(tasks))
+
+                        try:
+                            pdf_name, pdf_bytes = future.result()
+                        except Exception as e:
+                            st.error(f"Invoice #{invoice_number} for {row['MARK']} failed: {str(e)}")
+                            continue
+
+                        zipf.writestr(pdf_name, pdf_bytes)
+                        notification_rows.append(notification_entry(
+                            pdf_name,
+                            row["MARK"],
+                            invoice_number,
+                            row["CONTACT NUMBER"],
+                            row["TOTAL CHARGES_SUM"]
+                        ))
+
+            # Write the log once for the whole batch, in invoice order
+            if notification_rows:
+                notification_rows.sort(key=lambda entry: entry["Invoice"])
+                update_notification_sheet(OUTPUT_FOLDER, notification_rows)
             
-            st.markdown(
-                create_download_link(zip_path, "📥 Download All Invoices"),
-                unsafe_allow_html=True
-            )
+            with open(zip_path, "rb") as f:
+                st.download_button(
+                    "📥 Download All Invoices",
+                    f,
+                    file_name="invoices.zip",
+                    mime="application/zip"
+                )
             st.success("✅ All invoices generated successfully!")
         
         # Single Invoice Generation
@@ -794,7 +926,7 @@ def main():
         if st.session_state.consolidated_df is not None:
             customer = st.selectbox(
                 "Select Customer",
-                options=st.session_state.consolidated_df["MARK"].unique(),
+                options=st.session_state.customer_list,
                 key="customer_select"
             )
             single_num = st.number_input(
@@ -809,6 +941,7 @@ def main():
                     st.session_state.consolidated_df["MARK"] == customer
                 ].iloc[0]
                 
+                prune_render_cache()
                 pdf_path = generate_pdf_from_template(
                     TEMPLATE_PATH,
                     row.to_dict(),
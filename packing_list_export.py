@@ -11,16 +11,21 @@ Key features
 • Dark‑blue subtotal row (only when a customer has > 1 item)  
 • Grand totals calculated in the same columns  
 • Sheet name: “Packing List Print”  
+• Rows are streamed straight into the sheet XML (no spreadsheet
+  library in the loop), so memory stays flat for large lists  
 • Ready to be used with Streamlit’s download_button
 """
 
 import io
-from typing import List
+import math
+import re
+import zipfile
+from itertools import chain
+from typing import List, Optional, Union
+from xml.sax.saxutils import escape
 
+import numpy as np
 import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.utils import get_column_letter
 
 # ---------- CONFIG -----------------------------------------------------------
 
@@ -33,132 +38,365 @@ HEADERS: List[str] = [
 
 NUMERIC_TOTAL_COLS = {"QTY", "MEAS. (CBM)", "WEIGHT(KG)", "CBM", "TOTAL CHARGES"}
 
-HEADER_FILL = PatternFill(start_color="4682B4", end_color="4682B4", fill_type="solid")
-SUBTOTAL_FILL = PatternFill(start_color="4682B4", end_color="4682B4", fill_type="solid")
-HEADER_FONT = Font(bold=True)
-CENTER = Alignment(horizontal="center", vertical="center", wrap_text=True)
+# Multi-line columns that are split into one row per item
+ITEM_COLS: List[str] = ["RECEIPT NO.", "DESCRIPTION", "QTY", "MEAS. (CBM)", "WEIGHT(KG)"]
+
+# Columns only filled on the first item row of each consolidated row
+FIRST_ITEM_COLS: List[str] = [
+    "MARK", "PER CHARGES", "TOTAL CHARGES", "CONTACT NUMBER", "业务员/ Supplier",
+]
+
+SHEET_NAME = "Packing List Print"
+
+# Full ARGB colour: a 6-digit RGB gets a 00 alpha, which some viewers show as transparent
+FILL_COLOR = "FF4682B4"
+
+# Indices into <cellXfs> in STYLES_XML; each one is a named style, so
+# every cell of a row shares a single style record
+HEADER_STYLE = 1     # "Packing Header": bold, blue, centred and wrapped
+SUBTOTAL_STYLE = 2   # "Packing Subtotal": bold, blue
+TOTAL_STYLE = 3      # "Packing Total": bold
+
+# (name, font, fill, alignment) of each named style, in xfId order
+NAMED_STYLES = [
+    ("Normal", 0, 0, ""),
+    ("Packing Header", 1, 2, '<alignment horizontal="center" vertical="center" wrapText="1"/>'),
+    ("Packing Subtotal", 1, 2, ""),
+    ("Packing Total", 1, 0, ""),
+]
+
+# Column widths: header text + padding, clamped to 10..25 characters
+COLUMN_WIDTHS: List[int] = [max(10, min(25, len(header) + 2)) for header in HEADERS]
+COLUMN_LETTERS: List[str] = [chr(ord("A") + i) for i in range(len(HEADERS))]
+
+# ---------- XLSX PARTS -------------------------------------------------------
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+CONTENT_TYPES_XML = XML_DECLARATION + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '</Types>'
+)
+
+ROOT_RELS_XML = XML_DECLARATION + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+WORKBOOK_XML = XML_DECLARATION + (
+    f'<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}">'
+    f'<sheets><sheet name="{escape(SHEET_NAME)}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+WORKBOOK_RELS_XML = XML_DECLARATION + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+    f'<Relationship Id="rId2" Type="{REL_NS}/styles" Target="styles.xml"/>'
+    '</Relationships>'
+)
+
+def _style_xf(font: int, fill: int, alignment: str, xf_id=None) -> str:
+    """An <xf> record; with ``xf_id`` it is a cell format based on that named style."""
+    attrs = f'numFmtId="0" fontId="{font}" fillId="{fill}" borderId="0"'
+    if xf_id is not None:
+        attrs += f' xfId="{xf_id}"'
+        attrs += ' applyFont="1"' if font else ""
+        attrs += ' applyFill="1"' if fill else ""
+        attrs += ' applyAlignment="1"' if alignment else ""
+    return f"<xf {attrs}>{alignment}</xf>"
+
+
+STYLES_XML = XML_DECLARATION + (
+    f'<styleSheet xmlns="{MAIN_NS}">'
+    '<fonts count="2">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="3">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    f'<fill><patternFill patternType="solid"><fgColor rgb="{FILL_COLOR}"/>'
+    f'<bgColor rgb="{FILL_COLOR}"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    f'<cellStyleXfs count="{len(NAMED_STYLES)}">'
+    + "".join(_style_xf(font, fill, align) for _, font, fill, align in NAMED_STYLES)
+    + f'</cellStyleXfs><cellXfs count="{len(NAMED_STYLES)}">'
+    + "".join(
+        _style_xf(font, fill, align, xf_id)
+        for xf_id, (_, font, fill, align) in enumerate(NAMED_STYLES)
+    )
+    + f'</cellXfs><cellStyles count="{len(NAMED_STYLES)}">'
+    + "".join(
+        f'<cellStyle name="{name}" xfId="{xf_id}"' + (' builtinId="0"/>' if xf_id == 0 else "/>")
+        for xf_id, (name, _, _, _) in enumerate(NAMED_STYLES)
+    )
+    + '</cellStyles></styleSheet>'
+)
+
+SHEET_HEAD_XML = XML_DECLARATION + (
+    f'<worksheet xmlns="{MAIN_NS}"><cols>'
+    + "".join(
+        f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>'
+        for i, width in enumerate(COLUMN_WIDTHS, 1)
+    )
+    + '</cols><sheetData>'
+)
+SHEET_TAIL_XML = '</sheetData></worksheet>'
+
+# Control characters that are not allowed anywhere in XML 1.0
+ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
 
 # -----------------------------------------------------------------------------
 
 
-def _safe_float(x):
-    try:
-        return float(x)
-    except Exception:
-        return 0.0
+def _cell_xml(ref: str, value, style: int) -> str:
+    """
+    One ``<c>`` element: numbers as numeric cells, everything else as an
+    inline string. Empty (and NaN) cells are only written when styled.
+
+    Checks run in order of how common the value types are - text first.
+    """
+    s = f' s="{style}"' if style else ""
+    if isinstance(value, str):
+        if not value:
+            return f'<c r="{ref}"{s}/>' if style else ""
+    elif isinstance(value, (float, np.floating)):
+        if not math.isfinite(value):
+            return f'<c r="{ref}"{s}/>' if style else ""
+        return f'<c r="{ref}"{s}><v>{float(value)!r}</v></c>'
+    elif value is None:
+        return f'<c r="{ref}"{s}/>' if style else ""
+    elif isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    elif isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"{s}><v>{int(value)}</v></c>'
+    else:
+        value = str(value)
+
+    text = escape(ILLEGAL_XML_CHARS.sub("", value))
+    space = ' xml:space="preserve"' if text != text.strip() else ""
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+def _row_xml(row_number: int, values, style: int = 0) -> bytes:
+    row = str(row_number)
+    cells = "".join([
+        _cell_xml(letter + row, value, style)
+        for letter, value in zip(COLUMN_LETTERS, values)
+    ])
+    return f'<row r="{row}">{cells}</row>'.encode("utf-8")
+
+
+def _total_row(label: str, totals: pd.Series) -> list:
+    """
+    One list for the whole row; blank slots are None.
+
+    The label only occupies the first cell - the row is never merged, so
+    the sheet can be streamed row by row.
+    """
+    return [
+        label, None, None, f"{totals['QTY']:.2f}",
+        f"{totals['MEAS. (CBM)']:.3f}",
+        f"{totals['WEIGHT(KG)']:.2f}", None, None,
+        f"{totals['CBM']:.3f}", None,
+        f"{totals['TOTAL CHARGES']:.2f}", None, None
+    ]
 
 
-def export_custom_packing_list(df: pd.DataFrame) -> io.BytesIO:
+def _as_text(values: pd.Series) -> pd.Series:
+    """
+    ``str()`` every value. NaN deliberately becomes ``"nan"``, the same
+    text consolidate_data writes when it joins missing values.
+
+    Columns that already hold only strings are returned as they are.
+    """
+    if pd.api.types.is_string_dtype(values) and not values.isna().any():
+        return values
+    return pd.Series(values.to_numpy(dtype=object).astype(str), index=values.index)
+
+
+def _split_lines(values: pd.Series, row: np.ndarray, position: np.ndarray) -> np.ndarray:
+    """
+    Split every cell on newlines and lay the lines out per item: item ``i``
+    takes line ``position[i]`` of cell ``row[i]``; missing lines become None.
+    """
+    text = _as_text(values)
+    if len(row) == len(text):
+        # One item per row (the usual case): just the first line of each
+        # cell, no flattening needed
+        return text.str.split("\n", n=1).str[0].to_numpy()
+
+    # All lines in one flat array; each cell's lines start at its offset
+    lines = text.str.split("\n").tolist()
+    counts = np.fromiter(map(len, lines), dtype=np.intp, count=len(lines))
+    flat = np.array(list(chain.from_iterable(lines)), dtype=object)
+    offsets = np.cumsum(counts) - counts
+    present = position < counts[row]
+    out = np.full(len(row), None, dtype=object)
+    out[present] = flat[offsets[row[present]] + position[present]]
+    return out
+
+
+def _explode_items(work_df: pd.DataFrame, group: np.ndarray) -> pd.DataFrame:
+    """
+    Split the newline-joined consolidated rows into one row per item.
+
+    Every consolidated row yields as many items as it has receipt lines;
+    shorter item columns are padded with None and longer ones truncated.
+    Blank cells are None throughout, so the writer skips them without
+    inspecting the value.
+    """
+    work_df = work_df.reset_index(drop=True)
+    n_items = (_as_text(work_df["RECEIPT NO."]).str.count("\n") + 1).to_numpy(dtype=np.intp)
+    row = np.repeat(np.arange(len(work_df)), n_items)
+    position = np.arange(len(row)) - np.repeat(np.cumsum(n_items) - n_items, n_items)
+    first = position == 0
+
+    sources = {col: work_df[col] for col in ITEM_COLS}
+    sources["MEAS. (CBM)"] = work_df["MEAS. (CBM)"].where(
+        work_df["MEAS. (CBM)"].map(bool), work_df["CBM"]
+    )
+    long = pd.DataFrame(index=pd.RangeIndex(len(row)))
+    for col, values in sources.items():
+        long[col] = _split_lines(values, row, position)
+
+    # Values repeated from the consolidated row: pull each column's array
+    # once and index it, rather than repeating whole rows
+    for col in FIRST_ITEM_COLS:
+        long[col] = np.where(first, work_df[col].to_numpy(dtype=object)[row], None)
+
+    # Weight rate is parsed and formatted once per consolidated row
+    rate = pd.to_numeric(work_df["WEIGHT RATE"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    long["WEIGHT RATE"] = np.where(first, np.char.mod("%.2f", rate)[row], None)
+    weight_rate = rate[row]
+    has_rate = weight_rate != 0
+    if has_rate.any():
+        weights = pd.to_numeric(long["WEIGHT(KG)"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+        weight_cbm = weights / np.where(has_rate, weight_rate, 1.0)
+        long["WEIGHT CBM"] = np.where(has_rate, np.char.mod("%.3f", weight_cbm), None)
+    else:
+        long["WEIGHT CBM"] = None
+
+    # CBM is split per item when multi-line, otherwise repeated on every item
+    # (numbers never hold several lines, so they are not scanned at all)
+    cbm = work_df["CBM"]
+    long["CBM"] = cbm.to_numpy(dtype=object)[row]
+    if not pd.api.types.is_numeric_dtype(cbm):
+        multi_line = _as_text(cbm).str.contains("\n", regex=False).to_numpy(dtype=bool)
+        if multi_line.any():
+            long["CBM"] = np.where(multi_line[row], _split_lines(cbm, row, position), long["CBM"])
+    long["_group"] = group[row]
+    return long
+
+
+def export_custom_packing_list(
+    df: pd.DataFrame, out_path: Optional[str] = None, compress: bool = True
+) -> Union[io.BytesIO, str]:
     """
     Convert consolidated_df into an Excel file with per‑customer subtotals
     (blue) and an overall total row.
 
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The consolidated data.
+    out_path : str, optional
+        Write the workbook straight to this file instead of into memory.
+    compress : bool, default True
+        Deflate the workbook parts. Turn off to skip zlib when file size
+        does not matter; the file is larger but faster to produce.
+
     Returns
     -------
-    io.BytesIO
-        Binary Excel content ready for Streamlit download.
+    io.BytesIO or str
+        Binary Excel content ready for Streamlit download, or ``out_path``
+        once the file has been written.
     """
-    buffer = io.BytesIO()
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Packing List Print"
-
-    # ---- Header row ----
-    ws.append(HEADERS)
-    for col_idx, header in enumerate(HEADERS, 1):
-        cell = ws.cell(row=1, column=col_idx)
-        cell.font = HEADER_FONT
-        cell.alignment = CENTER
-        cell.fill = HEADER_FILL
-
-    current_row = 2
-    grand_totals = {k: 0.0 for k in NUMERIC_TOTAL_COLS}
-
-    # Ensure all expected columns exist in df
-    work_df = df.copy()
-    for col in HEADERS:
-        if col not in work_df.columns:
-            work_df[col] = ""
-
-    # ---- Process each customer (MARK) ----
-    for customer, group in work_df.groupby("MARK", sort=False):
-        item_rows = []
-
-        # Split multi‑line fields into individual item rows
-        for idx, g in group.iterrows():
-            num_items = str(g["RECEIPT NO."]).count("\n") + 1
-            receipts = str(g["RECEIPT NO."]).split("\n")
-            descs = str(g["DESCRIPTION"]).split("\n")
-            qtys = str(g["QTY"]).split("\n")
-            meas_cbms = str(g["MEAS. (CBM)"] or g["CBM"]).split("\n")
-            weights = str(g["WEIGHT(KG)"]).split("\n")
-
-            weight_rate = _safe_float(g.get("WEIGHT RATE", 0))
-
-            for i in range(num_items):
-                item_rows.append({
-                    "RECEIPT NO.": receipts[i] if i < len(receipts) else "",
-                    "MARK": customer if i == 0 else "",
-                    "DESCRIPTION": descs[i] if i < len(descs) else "",
-                    "QTY": qtys[i] if i < len(qtys) else "",
-                    "MEAS. (CBM)": meas_cbms[i] if i < len(meas_cbms) else "",
-                    "WEIGHT(KG)": weights[i] if i < len(weights) else "",
-                    "WEIGHT RATE": f"{weight_rate:.2f}" if i == 0 else "",
-                    "WEIGHT CBM": f"{_safe_float(weights[i]) / weight_rate:.3f}" if weight_rate else "",
-                    "CBM": g["CBM"].split("\n")[i] if "\n" in str(g["CBM"]) else g["CBM"],
-                    "PER CHARGES": g["PER CHARGES"] if i == 0 else "",
-                    "TOTAL CHARGES": g["TOTAL CHARGES"] if i == 0 else "",
-                    "CONTACT NUMBER": g["CONTACT NUMBER"] if i == 0 else "",
-                    "业务员/ Supplier": g["业务员/ Supplier"] if i == 0 else "",})
-
-        # Write item rows
-        for item in item_rows:
-            ws.append([item[col] for col in HEADERS])
-            for col_name in NUMERIC_TOTAL_COLS:
-                grand_totals[col_name] += _safe_float(item[col_name])
-            current_row += 1
-
-        # Subtotal row (only if >1 item)
-        if len(item_rows) > 1:
-            subtotal_vals = {k: 0.0 for k in NUMERIC_TOTAL_COLS}
-            for item in item_rows:
-                for k in NUMERIC_TOTAL_COLS:
-                    subtotal_vals[k] += _safe_float(item[k])
-
-            ws.append([
-                f"{customer} TOTAL", "", "",                           # first 3 cols
-                f"{subtotal_vals['QTY']:.2f}",
-                f"{subtotal_vals['MEAS. (CBM)']:.3f}",
-                f"{subtotal_vals['WEIGHT(KG)']:.2f}",
-                "", "", f"{subtotal_vals['CBM']:.3f}", "",
-                f"{subtotal_vals['TOTAL CHARGES']:.2f}", "", ""
-            ])
-            # Color subtotal row
-            for col_idx in range(1, len(HEADERS) + 1):
-                cell = ws.cell(row=current_row, column=col_idx)
-                cell.fill = SUBTOTAL_FILL
-                cell.font = Font(bold=True)
-            current_row += 1
-
-    # ---- Grand total row ----
-    ws.append([
-        "GRAND TOTAL", "", "", f"{grand_totals['QTY']:.2f}",
-        f"{grand_totals['MEAS. (CBM)']:.3f}",
-        f"{grand_totals['WEIGHT(KG)']:.2f}", "", "",
-        f"{grand_totals['CBM']:.3f}", "",
-        f"{grand_totals['TOTAL CHARGES']:.2f}", "", ""
-    ])
-    for col_idx in range(1, len(HEADERS) + 1):
-        cell = ws.cell(row=current_row, column=col_idx)
-        cell.font = Font(bold=True)
-
-    # ---- Auto‑size columns ----
-    for col in ws.columns:
-        first_cell = next((c for c in col if c.value not in (None, "")), None)
-        if first_cell:
-            width = min(25, len(str(first_cell.value)) + 2)
-            ws.column_dimensions[get_column_letter(first_cell.column)].width = max(10, width)
-
-    wb.save(buffer)
+    # Ensure all expected columns exist, without copying the whole frame
+    missing = [col for col in HEADERS if col not in df.columns]
+    work_df = df.assign(**dict.fromkeys(missing, "")) if missing else df
+
+    # ---- Split every customer's rows into items in one pass ----
+    marks = work_df["MARK"].astype("category")
+    group = work_df.groupby(marks, sort=False, observed=True).ngroup().to_numpy()
+    keep = np.flatnonzero(group >= 0)
+    order = keep[np.argsort(group[keep], kind="stable")]
+    if len(order) != len(work_df) or (np.diff(order) != 1).any():
+        work_df = work_df.take(order)
+    group = group[order].astype(np.intp)
+    items = _explode_items(work_df, group)
+    customers = pd.unique(work_df["MARK"]).tolist()
+    bounds = np.searchsorted(items["_group"].to_numpy(), np.arange(len(customers) + 1))
+
+    # ---- Subtotals and grand totals (unparseable values count as 0) ----
+    total_cols = [col for col in HEADERS if col in NUMERIC_TOTAL_COLS]
+    amounts = items[total_cols].apply(pd.to_numeric, errors="coerce").fillna(0.0)
+    grand_totals = amounts.sum()
+
+    # ---- Plan the subtotal rows: last item index -> row values ----
+    # Only customers with more than one item get a subtotal row; when there
+    # are none the subtotals are not computed at all
+    multi = np.flatnonzero(np.diff(bounds) > 1)
+    subtotal_plan = {}
+    if len(multi):
+        subtotals = amounts.groupby(items["_group"]).sum().loc[multi]
+        subtotal_plan = {
+            int(bounds[group_idx + 1]) - 1: _total_row(f"{customers[group_idx]} TOTAL", totals)
+            for group_idx, totals in subtotals.to_dict("index").items()
+        }
+
+    buffer = io.BytesIO() if out_path is None else out_path
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(buffer, "w", compression) as xlsx:
+        xlsx.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        xlsx.writestr("_rels/.rels", ROOT_RELS_XML)
+        xlsx.writestr("xl/workbook.xml", WORKBOOK_XML)
+        xlsx.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML)
+        xlsx.writestr("xl/styles.xml", STYLES_XML)
+
+        with xlsx.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            sheet.write(SHEET_HEAD_XML.encode("utf-8"))
+
+            # ---- Header row ----
+            sheet.write(_row_xml(1, HEADERS, HEADER_STYLE))
+            row_number = 2
+
+            # ---- Item rows, with each planned subtotal after its customer ----
+            # Each column is pulled out as a plain object array once, so
+            # building a row is just indexing, not pandas scalar access
+            rows = zip(*(items[col].to_numpy(dtype=object) for col in HEADERS))
+            if not subtotal_plan:
+                # Every customer has a single item: nothing to interleave
+                sheet.writelines(_row_xml(n, item) for n, item in enumerate(rows, row_number))
+                row_number += len(items)
+            else:
+                for item_idx, item in enumerate(rows):
+                    sheet.write(_row_xml(row_number, item))
+                    row_number += 1
+                    subtotal = subtotal_plan.get(item_idx)
+                    if subtotal is not None:
+                        sheet.write(_row_xml(row_number, subtotal, SUBTOTAL_STYLE))
+                        row_number += 1
+
+            # ---- Grand total row ----
+            grand_total = _total_row("GRAND TOTAL", grand_totals)
+            sheet.write(_row_xml(row_number, grand_total, TOTAL_STYLE))
+            sheet.write(SHEET_TAIL_XML.encode("utf-8"))
+
+    if out_path is not None:
+        return out_path
     buffer.seek(0)
     return buffer